@@ -1,10 +1,16 @@
 import os
 import re
 import sys
+import hashlib
+import mmap
 import requests
 import shutil
 import json
+import sqlite3
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PyQt5 import QtWidgets
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
@@ -22,25 +28,427 @@ except ImportError:
     SPOTIFY_CLIENT_ID = None
     SPOTIFY_CLIENT_SECRET = None
 
+# USB sync settings (head unit limits for FAT32/exFAT sticks)
+USB_MANIFEST_NAME = 'hyundai_sync_manifest.json'
+USB_COPY_CHUNK_SIZE = 4 * 1024 * 1024  # Large sequential writes for slow USB media
+USB_MAX_PATH_LENGTH = 250  # Max length of path relative to stick root
+USB_MAX_FILES_PER_FOLDER = 255  # Max MP3 files the head unit lists per folder
+
+# Shared HTTP settings (Spotify API and cover downloads)
+HTTP_POOL_SIZE = 8  # Fixed cap of keep-alive connections per host
+HTTP_MAX_RETRIES = 3  # Retries on connection errors and transient status codes
+HTTP_BACKOFF_FACTOR = 0.5  # Wait 0.5s, 1s, 2s ... between retries
+HTTP_TIMEOUT = 10  # Seconds per request
+
+# Offline metadata catalog (filled by imports and by every Spotify album lookup)
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.db')
+
+# Audio content hash index (duplicate detection, unchanged-audio checks)
+HASH_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hash_index.db')
+HASH_WORKERS = 4  # Parallel hash workers (hashlib releases the GIL)
+
+class MetadataCatalog:
+    """Local indexed store of album/track metadata (Spotify album format)"""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS albums (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                norm_name TEXT,
+                data TEXT
+            );
+            CREATE TABLE IF NOT EXISTS album_artists (
+                album_id TEXT,
+                name TEXT,
+                norm_name TEXT
+            );
+            CREATE TABLE IF NOT EXISTS tracks (
+                album_id TEXT,
+                track_number INTEGER,
+                name TEXT,
+                norm_name TEXT,
+                artist TEXT,
+                norm_artist TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_albums_norm_name ON albums(norm_name);
+            CREATE INDEX IF NOT EXISTS idx_album_artists_album ON album_artists(album_id);
+            CREATE INDEX IF NOT EXISTS idx_album_artists_norm_name ON album_artists(norm_name);
+            CREATE INDEX IF NOT EXISTS idx_tracks_album ON tracks(album_id);
+            CREATE INDEX IF NOT EXISTS idx_tracks_norm_name ON tracks(norm_name);
+            CREATE INDEX IF NOT EXISTS idx_tracks_norm_artist ON tracks(norm_artist);
+        """)
+
+    @staticmethod
+    def normalize(name):
+        """Normalizes names for index lookups (case and whitespace insensitive)"""
+        return ' '.join((name or '').casefold().split())
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM albums').fetchone()[0]
+
+    def add_album(self, album, commit=True):
+        """Stores an album object (Spotify format incl. tracks) in the catalog"""
+        album_id = album['id']
+        self.db.execute('DELETE FROM album_artists WHERE album_id = ?', (album_id,))
+        self.db.execute('DELETE FROM tracks WHERE album_id = ?', (album_id,))
+        self.db.execute(
+            'INSERT OR REPLACE INTO albums (id, name, norm_name, data) VALUES (?, ?, ?, ?)',
+            (album_id, album['name'], self.normalize(album['name']), json.dumps(album, ensure_ascii=False))
+        )
+        self.db.executemany(
+            'INSERT INTO album_artists (album_id, name, norm_name) VALUES (?, ?, ?)',
+            [(album_id, a['name'], self.normalize(a['name'])) for a in album.get('artists', [])]
+        )
+        track_rows = []
+        for track in album.get('tracks', {}).get('items', []):
+            artist = track['artists'][0]['name'] if track.get('artists') else ''
+            track_rows.append((album_id, track['track_number'], track['name'],
+                               self.normalize(track['name']), artist, self.normalize(artist)))
+        self.db.executemany(
+            'INSERT INTO tracks (album_id, track_number, name, norm_name, artist, norm_artist) '
+            'VALUES (?, ?, ?, ?, ?, ?)', track_rows
+        )
+        if commit:
+            self.db.commit()
+
+    def get_album(self, album_id):
+        row = self.db.execute('SELECT data FROM albums WHERE id = ?', (album_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_albums(self, album_name):
+        """Returns all albums with this (normalized) name"""
+        rows = self.db.execute(
+            'SELECT data FROM albums a WHERE norm_name = ? '
+            'AND EXISTS (SELECT 1 FROM tracks t WHERE t.album_id = a.id)',
+            (self.normalize(album_name),)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def find_track(self, title, artist=None):
+        """Finds a track by title (and artist), returns it in Spotify search format"""
+        norm_title = self.normalize(title)
+        if artist:
+            norm_artist = self.normalize(artist)
+            row = self.db.execute(
+                'SELECT t.name, t.artist, a.id, a.name FROM tracks t JOIN albums a ON a.id = t.album_id '
+                'WHERE t.norm_name = ? AND t.norm_artist = ? LIMIT 1', (norm_title, norm_artist)
+            ).fetchone()
+            if not row:
+                # Featured artists: "Drake" matches "Drake feat. Rihanna"
+                row = self.db.execute(
+                    'SELECT t.name, t.artist, a.id, a.name FROM tracks t JOIN albums a ON a.id = t.album_id '
+                    'WHERE t.norm_name = ? AND t.norm_artist != \'\' '
+                    'AND (instr(t.norm_artist, ?) > 0 OR instr(?, t.norm_artist) > 0) '
+                    'LIMIT 1', (norm_title, norm_artist, norm_artist)
+                ).fetchone()
+        else:
+            # Title only: common titles ("Intro") exist on many albums, only unique hits count
+            rows = self.db.execute(
+                'SELECT t.name, t.artist, a.id, a.name FROM tracks t JOIN albums a ON a.id = t.album_id '
+                'WHERE t.norm_name = ? LIMIT 2', (norm_title,)
+            ).fetchall()
+            row = rows[0] if len(rows) == 1 else None
+
+        if not row:
+            return None
+        return {
+            'name': row[0],
+            'artists': [{'name': row[1]}] if row[1] else [],
+            'album': {'id': row[2], 'name': row[3]}
+        }
+
+    def import_file(self, path):
+        """Imports a JSON export, MusicBrainz-style dump or another catalog.db, returns album count"""
+        if path.lower().endswith('.db'):
+            return self.import_catalog_db(path)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            # MusicBrainz dumps are JSON lines (one release per line)
+            try:
+                data = [json.loads(line) for line in content.splitlines() if line.strip()]
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{os.path.basename(path)} is neither JSON nor JSON lines: {e}")
+
+        albums = [self.convert_musicbrainz_release(item) if 'artist-credit' in item else self.unwrap_album(item)
+                  for item in self.unwrap_entries(data, path)]
+
+        count = 0
+        for album in albums:
+            if self.has_tracks(album):
+                self.add_album(album, commit=False)
+                count += 1
+            else:
+                print(f"Skipping catalog entry without tracks: {album.get('name')}")
+        self.db.commit()
+        return count
+
+    def unwrap_entries(self, data, path):
+        """Returns the list of album/release objects of an export, raises ValueError for unknown formats"""
+        if isinstance(data, dict):
+            # Spotify export {"albums": [...]} or paged {"albums": {"items": [...]}},
+            # MusicBrainz search {"releases": [...]}, paged {"items": [...]} or single object
+            for key in ('albums', 'releases', 'items'):
+                if key in data:
+                    data = data[key]
+                    break
+            else:
+                data = [data]
+        if isinstance(data, dict) and isinstance(data.get('items'), list):
+            data = data['items']
+
+        if not isinstance(data, list):
+            raise ValueError(f"Unrecognized catalog format in {os.path.basename(path)}")
+        for item in data:
+            # Saved albums export wraps each album: {"added_at": ..., "album": {...}}
+            entry = item.get('album', item) if isinstance(item, dict) and 'id' not in item else item
+            if not isinstance(entry, dict) or 'id' not in entry or not (entry.get('name') or entry.get('title')):
+                raise ValueError(
+                    f"Unrecognized catalog format in {os.path.basename(path)}: "
+                    'expected Spotify albums or MusicBrainz releases with "id" and "name"/"title"'
+                )
+        return [item.get('album', item) if 'id' not in item else item for item in data]
+
+    def unwrap_album(self, album):
+        """Normalizes a Spotify album object (track list as paging object {"items": [...]})"""
+        tracks = album.get('tracks')
+        if isinstance(tracks, list):
+            album = dict(album, tracks={'items': tracks})
+        return album
+
+    def import_catalog_db(self, path):
+        """Merges another catalog.db (e.g. from a previous run on another machine)"""
+        other = sqlite3.connect(path)
+        try:
+            rows = other.execute('SELECT data FROM albums').fetchall()
+        finally:
+            other.close()
+        count = 0
+        for row in rows:
+            album = json.loads(row[0])
+            if self.has_tracks(album):
+                self.add_album(album, commit=False)
+                count += 1
+        self.db.commit()
+        return count
+
+    @staticmethod
+    def has_tracks(album):
+        """Albums without track list (e.g. MusicBrainz search results) are useless for matching"""
+        return bool(album and album.get('id') and album.get('name')
+                    and album.get('tracks', {}).get('items'))
+
+    def convert_musicbrainz_release(self, release):
+        """Converts a MusicBrainz release object to Spotify album format"""
+        artists = []
+        for credit in release.get('artist-credit', []):
+            if isinstance(credit, dict):
+                name = credit.get('name') or credit.get('artist', {}).get('name')
+                if name:
+                    artists.append({'name': name})
+
+        tracks = []
+        track_number = 0
+        for medium in release.get('media', []):
+            for track in medium.get('tracks', []):
+                track_number += 1
+                tracks.append({
+                    'name': track.get('title') or track.get('recording', {}).get('title', ''),
+                    'track_number': track_number,
+                    'artists': artists[:1]
+                })
+
+        images = []
+        if release.get('cover-art-archive', {}).get('front'):
+            images.append({'url': f"https://coverartarchive.org/release/{release['id']}/front"})
+
+        return {
+            'id': f"mbid:{release['id']}",
+            'name': release.get('title', ''),
+            'artists': artists,
+            'images': images,
+            'tracks': {'items': tracks}
+        }
+
+class AudioHashIndex:
+    """Persistent index of MP3 audio hashes (ID3 tags and cover art excluded)"""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS audio_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                audio_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_audio_hashes_hash ON audio_hashes(audio_hash);
+        """)
+
+    @staticmethod
+    def compute_audio_hash(mp3_path):
+        """Hashes only the audio frames (skips ID3v2 incl. APIC and ID3v1 tag), None without audio"""
+        digest = hashlib.sha1()
+        with open(mp3_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                # Skip (possibly several) ID3v2 tags at the start
+                while size - start >= 10 and mm[start:start + 3] == b'ID3':
+                    tag_size = (mm[start + 6] << 21) | (mm[start + 7] << 14) | (mm[start + 8] << 7) | mm[start + 9]
+                    footer = 10 if mm[start + 5] & 0x10 else 0
+                    start += 10 + tag_size + footer
+
+                end = size
+                if end - start >= 128 and mm[end - 128:end - 125] == b'TAG':
+                    end -= 128
+
+                # Empty, tag-only or broken files (tag size beyond EOF) have no audio to compare
+                if start >= end:
+                    return None
+
+                view = memoryview(mm)
+                try:
+                    digest.update(view[start:end])
+                finally:
+                    view.release()
+        return digest.hexdigest()
+
+    def get_hashes(self, paths, force=False):
+        """Returns {path: audio_hash}, computes only new or modified files (all files with force)"""
+        hashes = {}
+        missing = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            abs_path = os.path.abspath(path)
+            row = None if force else self.db.execute(
+                'SELECT size, mtime_ns, audio_hash FROM audio_hashes WHERE path = ?', (abs_path,)
+            ).fetchone()
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                # NULL hash: file without audio payload (cached, so it isn't mapped again)
+                if row[2] is not None:
+                    hashes[path] = row[2]
+            else:
+                missing.append((path, abs_path, stat))
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+                results = pool.map(self._safe_audio_hash, [path for path, _, _ in missing])
+                for (path, abs_path, stat), (ok, audio_hash) in zip(missing, results):
+                    if not ok:
+                        continue  # Read errors are retried next time
+                    if audio_hash is not None:
+                        hashes[path] = audio_hash
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO audio_hashes (path, size, mtime_ns, audio_hash) VALUES (?, ?, ?, ?)',
+                        (abs_path, stat.st_size, stat.st_mtime_ns, audio_hash)
+                    )
+            self.db.commit()
+
+        return hashes
+
+    def get_hash(self, path):
+        return self.get_hashes([path]).get(path)
+
+    def find_duplicates(self, paths):
+        """Groups paths with identical audio content, returns only groups with 2+ files"""
+        groups = {}
+        for path, audio_hash in self.get_hashes(paths).items():
+            if audio_hash is not None:
+                groups.setdefault(audio_hash, []).append(path)
+        return {h: sorted(p) for h, p in groups.items() if len(p) > 1}
+
+    @staticmethod
+    def compute_file_digest(path):
+        """Hashes the complete file (all tags and audio), used where copies must be exact"""
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return digest.hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    digest.update(view)
+                finally:
+                    view.release()
+        return digest.hexdigest()
+
+    def _safe_audio_hash(self, path):
+        """Returns (ok, audio_hash), ok is False on read errors"""
+        try:
+            return True, self.compute_audio_hash(path)
+        except Exception as e:
+            print(f"Error hashing {path}: {e}")
+            return False, None
+
 class Mp3MetadataApp(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.init_ui()
         
+        # Local catalog is checked before every Spotify lookup
+        self.catalog = MetadataCatalog(CATALOG_FILE)
+        
+        # Audio hashes for duplicate detection, backup/restore and USB sync
+        self.hash_index = AudioHashIndex(HASH_INDEX_FILE)
+        
+        # One pooled session for Spotify and cover downloads (reuses TLS connections)
+        self.http = self.create_http_session()
+        
         # Check if API credentials are available
         if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET or SPOTIFY_CLIENT_ID == 'YOUR_CLIENT_ID_HERE':
-            QtWidgets.QMessageBox.critical(
-                self, 'Configuration Error',
+            # Offline mode: all lookups are served from the local catalog
+            QtWidgets.QMessageBox.warning(
+                self, 'Offline Mode',
                 'Spotify API credentials not configured!\n\n'
-                'Please edit config.py and add your Spotify API credentials.\n'
+                f'Using only the local catalog ({self.catalog.count()} albums).\n'
+                'Use "Import Catalog" to add album data, or edit config.py and add your Spotify API credentials.\n'
                 'Visit https://developer.spotify.com/dashboard/ to get your credentials.'
             )
-            sys.exit(1)
+            self.spotify = None
+            return
         
-        self.spotify = Spotify(auth_manager=SpotifyClientCredentials(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET
-        ))
+        self.spotify = Spotify(
+            auth_manager=SpotifyClientCredentials(
+                client_id=SPOTIFY_CLIENT_ID,
+                client_secret=SPOTIFY_CLIENT_SECRET,
+                requests_session=self.http
+            ),
+            requests_session=self.http,
+            requests_timeout=HTTP_TIMEOUT
+        )
+
+    def create_http_session(self):
+        """Creates HTTP session with keep-alive pools and retry with backoff"""
+        retry = Retry(
+            total=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True
+        )
+        # pool_block limits open connections per host to the pool size
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=retry,
+            pool_block=True
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
 
     def init_ui(self):
         self.setWindowTitle('Hyundai Music Optimizer')
@@ -66,6 +474,10 @@ class Mp3MetadataApp(QtWidgets.QWidget):
         self.apply_btn.clicked.connect(self.auto_process_albums)
         self.restore_btn = QtWidgets.QPushButton('Restore Backup')
         self.restore_btn.clicked.connect(self.restore_backup)
+        self.sync_btn = QtWidgets.QPushButton('Sync to USB')
+        self.sync_btn.clicked.connect(self.sync_to_usb)
+        self.catalog_btn = QtWidgets.QPushButton('Import Catalog')
+        self.catalog_btn.clicked.connect(self.import_catalog)
         self.progress = QtWidgets.QProgressBar()
         self.progress.setVisible(False)
         self.layout.addWidget(self.folder_btn)
@@ -76,6 +488,8 @@ class Mp3MetadataApp(QtWidgets.QWidget):
         button_layout = QtWidgets.QHBoxLayout()
         button_layout.addWidget(self.apply_btn)
         button_layout.addWidget(self.restore_btn)
+        button_layout.addWidget(self.sync_btn)
+        button_layout.addWidget(self.catalog_btn)
         self.layout.addLayout(button_layout)
         self.layout.addWidget(self.progress)
         self.setLayout(self.layout)
@@ -95,8 +509,31 @@ class Mp3MetadataApp(QtWidgets.QWidget):
             
             self.progress.setVisible(False)
 
+    def flag_duplicates(self, root_folder):
+        """Marks files with identical audio content (e.g. same recording in two albums)"""
+        file_items = {}
+        
+        def collect_files(item):
+            for i in range(item.childCount()):
+                child = item.child(i)
+                path = child.data(0, 1)
+                if path and os.path.isfile(path):
+                    file_items[path] = child
+                collect_files(child)
+        
+        for i in range(self.folder_tree.topLevelItemCount()):
+            collect_files(self.folder_tree.topLevelItem(i))
+        
+        for paths in self.hash_index.find_duplicates(list(file_items)).values():
+            for path in paths:
+                others = [os.path.relpath(p, root_folder) for p in paths if p != path]
+                file_items[path].setText(2, 'Duplicate')
+                file_items[path].setToolTip(2, 'Same audio as:\n' + '\n'.join(others))
+                print(f"Duplicate audio: {path} = {', '.join(others)}")
+
     def populate_tree(self, root_folder):
         self._add_folder_item(self.folder_tree, root_folder)
+        self.flag_duplicates(root_folder)
 
     def _add_folder_item(self, parent, folder_path):
         mp3_files = self.find_mp3_files(folder_path, only_current=True)
@@ -129,13 +566,13 @@ class Mp3MetadataApp(QtWidgets.QWidget):
                         title = parts[1].strip()
                         query = f"artist:{artist} track:{title}"
                     else:
+                        artist = None
+                        title = clean_name
                         query = clean_name
                     
-                    # Spotify search
-                    results = self.spotify.search(q=query, type='track', limit=3)
-                    if results['tracks']['items']:
-                        # Take first result for album detection
-                        track = results['tracks']['items'][0]
+                    # Catalog or Spotify search (first result for album detection)
+                    track = self.search_track(query, title, artist, limit=3)
+                    if track:
                         album_name = track['album']['name']
                         artist_name = track['artists'][0]['name'] if track['artists'] else ''
                         if album_name and artist_name:
@@ -203,23 +640,48 @@ class Mp3MetadataApp(QtWidgets.QWidget):
             
             backup_folder = os.path.join(backups_dir, f"BACKUP_{os.path.basename(folder_path)}_{timestamp}")
             
+            # Audio hashes verify restores, full-file digests dedupe backups (copies must be exact)
+            mp3_files = self.find_mp3_files(folder_path)
+            audio_hashes = self.hash_index.get_hashes(mp3_files)
+            file_digests = {p: self.hash_index.compute_file_digest(p) for p in mp3_files}
+            
+            # Identical files already in earlier backups are hard-linked instead of copied
+            existing_copies = self.find_backup_copies(backups_dir)
+            linked = []
+            
+            def copy_or_link(src, dst):
+                previous = existing_copies.get(file_digests.get(src))
+                if previous and os.path.getsize(previous) == os.path.getsize(src):
+                    try:
+                        os.link(previous, dst)
+                        linked.append(dst)
+                        return dst
+                    except OSError:
+                        pass  # File system without hard links
+                return shutil.copy2(src, dst)
+            
             print(f"Creating backup in: {backup_folder}")
-            shutil.copytree(folder_path, backup_folder)
+            shutil.copytree(folder_path, backup_folder, copy_function=copy_or_link)
+            if linked:
+                print(f"{len(linked)} unchanged files linked from earlier backups")
             
             # Save backup info in JSON
             backup_info = {
                 "original_folder": folder_path,
                 "backup_folder": backup_folder,
                 "timestamp": timestamp,
-                "files": []
+                "files": [],
+                "audio_hashes": {},
+                "file_digests": {}
             }
             
-            # List all MP3 files
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    if file.lower().endswith('.mp3'):
-                        rel_path = os.path.relpath(os.path.join(root, file), folder_path)
-                        backup_info["files"].append(rel_path)
+            # List all MP3 files with content hashes
+            for mp3_path in mp3_files:
+                rel_path = os.path.relpath(mp3_path, folder_path)
+                backup_info["files"].append(rel_path)
+                backup_info["file_digests"][rel_path] = file_digests[mp3_path]
+                if mp3_path in audio_hashes:
+                    backup_info["audio_hashes"][rel_path] = audio_hashes[mp3_path]
             
             info_file = os.path.join(backup_folder, "backup_info.json")
             with open(info_file, 'w', encoding='utf-8') as f:
@@ -311,6 +773,25 @@ class Mp3MetadataApp(QtWidgets.QWidget):
         self.folder_tree.clear()
         self.populate_tree(self.selected_folder)
 
+    def find_backup_copies(self, backups_dir):
+        """Maps full-file digests to files in earlier backups"""
+        copies = {}
+        for name in sorted(os.listdir(backups_dir)):
+            info_file = os.path.join(backups_dir, name, "backup_info.json")
+            if not os.path.exists(info_file):
+                continue
+            try:
+                with open(info_file, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+            except Exception as e:
+                print(f"Error reading {info_file}: {e}")
+                continue
+            for rel_path, file_digest in info.get("file_digests", {}).items():
+                path = os.path.join(backups_dir, name, rel_path)
+                if os.path.exists(path):
+                    copies[file_digest] = path
+        return copies
+
     def get_artist_album_name_from_spotify(self, album_name, artist_name):
         """Determines artist-album name directly from Spotify album (album artist, not track artist)"""
         try:
@@ -321,7 +802,9 @@ class Mp3MetadataApp(QtWidgets.QWidget):
                 if hasattr(self, '_album_info_cache') and album_id in self._album_info_cache:
                     album_info = self._album_info_cache[album_id]
                 else:
-                    album_info = self.spotify.album(album_id)
+                    album_info = self.catalog.get_album(album_id)
+                    if not album_info and self.spotify:
+                        album_info = self.spotify.album(album_id)
                     # Cache for later use
                     if not hasattr(self, '_album_info_cache'):
                         self._album_info_cache = {}
@@ -402,14 +885,19 @@ class Mp3MetadataApp(QtWidgets.QWidget):
             )
             
             if reply == QtWidgets.QMessageBox.Yes:
-                # Delete current folder (if exists)
-                if os.path.exists(original_folder):
-                    shutil.rmtree(original_folder)
-                
-                # Copy backup back (without backup_info.json)
-                shutil.copytree(backup_folder, original_folder, ignore=shutil.ignore_patterns('backup_info.json'))
+                copied, reused, failed = self.restore_backup_files(backup_folder, original_folder, backup_info)
                 
-                QtWidgets.QMessageBox.information(self, 'Success', 'Backup restored successfully!')
+                if failed:
+                    QtWidgets.QMessageBox.warning(
+                        self, 'Restore Incomplete',
+                        f'{len(failed)} files could not be verified:\n' + '\n'.join(failed[:10])
+                    )
+                else:
+                    QtWidgets.QMessageBox.information(
+                        self, 'Success',
+                        f'Backup restored successfully!\n\n'
+                        f'{copied} files copied, {reused} files unchanged or moved.'
+                    )
                 
                 # Update tree
                 if hasattr(self, 'selected_folder'):
@@ -419,6 +907,344 @@ class Mp3MetadataApp(QtWidgets.QWidget):
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, 'Error', f'Error restoring backup: {e}')
 
+    def restore_backup_files(self, backup_folder, original_folder, backup_info):
+        """Restores files, only copies files whose audio or tags differ"""
+        backup_files = []
+        for root, _, files in os.walk(backup_folder):
+            for file in files:
+                rel_path = os.path.relpath(os.path.join(root, file), backup_folder)
+                if rel_path != 'backup_info.json':
+                    backup_files.append(rel_path)
+        
+        # Current MP3s by audio hash, so renamed but unchanged files are moved back instead of copied
+        current_files = {}
+        if os.path.exists(original_folder):
+            current_files = self.hash_index.get_hashes(self.find_mp3_files(original_folder))
+        
+        backup_mp3s = [os.path.join(backup_folder, r) for r in backup_files if r.lower().endswith('.mp3')]
+        backup_hashes = self.hash_index.get_hashes(backup_mp3s)
+        
+        # Same audio hash is only a candidate, reuse requires identical bytes (all tags included)
+        file_digests = {}
+        def same_file(a, b):
+            for path in (a, b):
+                if path not in file_digests:
+                    file_digests[path] = self.hash_index.compute_file_digest(path)
+            return file_digests[a] == file_digests[b]
+        
+        copied = 0
+        reused = 0
+        for rel_path in backup_files:
+            src = os.path.join(backup_folder, rel_path)
+            dst = os.path.join(original_folder, rel_path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            
+            if src in backup_hashes:
+                audio_hash = backup_hashes[src]
+                if current_files.get(dst) == audio_hash and same_file(src, dst):
+                    current_files.pop(dst)
+                    reused += 1
+                    continue
+                
+                moved_from = next((p for p, h in current_files.items()
+                                   if h == audio_hash and p != dst and same_file(src, p)), None)
+                if moved_from and not os.path.exists(dst):
+                    os.rename(moved_from, dst)
+                    current_files.pop(moved_from)
+                    reused += 1
+                    continue
+            
+            current_files.pop(dst, None)
+            shutil.copy2(src, dst)
+            copied += 1
+        
+        # Remove files that are not part of the backup
+        restored = set(os.path.normcase(os.path.join(original_folder, r)) for r in backup_files)
+        for root, dirs, files in os.walk(original_folder, topdown=False):
+            for file in files:
+                path = os.path.join(root, file)
+                if os.path.normcase(path) not in restored:
+                    os.remove(path)
+            if root != original_folder and not os.listdir(root):
+                os.rmdir(root)
+        
+        # Verify restored audio against the hashes recorded at backup time
+        expected = backup_info.get("audio_hashes") or {
+            os.path.relpath(p, backup_folder): h for p, h in backup_hashes.items()
+        }
+        restored_paths = {rel: os.path.join(original_folder, rel) for rel in expected}
+        # Read restored files again (cache would return the hashes from backup time for unchanged size/mtime)
+        restored_hashes = self.hash_index.get_hashes(list(restored_paths.values()), force=True)
+        failed = [rel for rel, path in restored_paths.items() if restored_hashes.get(path) != expected[rel]]
+        
+        return copied, reused, failed
+
+    def sync_to_usb(self):
+        """Synchronizes the processed library to a USB stick (only changed files)"""
+        if not hasattr(self, 'selected_folder'):
+            QtWidgets.QMessageBox.information(self, 'Info', 'Please select a music folder first!')
+            return
+
+        target_folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select USB Stick')
+        if not target_folder:
+            return
+
+        try:
+            # Target inside the library (or library inside target) would sync the copies again
+            if self.paths_nested(target_folder, self.selected_folder):
+                QtWidgets.QMessageBox.warning(self, 'Error', 'USB target and music folder must not contain each other!')
+                return
+
+            manifest = self.load_usb_manifest(target_folder)
+            plan, skipped = self.plan_usb_sync(self.selected_folder)
+
+            # Hash new/modified files in parallel up front (cached in the hash index)
+            self.hash_index.get_hashes(list(plan.values()))
+
+            self.progress.setVisible(True)
+            self.progress.setMaximum(max(len(plan), 1))
+
+            new_files = {}
+            copied_count = 0
+            for i, (target_rel, source_path) in enumerate(sorted(plan.items())):
+                self.progress.setValue(i + 1)
+                QtWidgets.QApplication.processEvents()
+
+                target_path = os.path.join(target_folder, target_rel)
+                entry = self.get_usb_file_entry(source_path, manifest['files'].get(target_rel))
+
+                if os.path.exists(target_path) and not self.usb_file_changed(entry, manifest['files'].get(target_rel)):
+                    new_files[target_rel] = entry
+                    continue
+
+                try:
+                    self.copy_file_chunked(source_path, target_path)
+                    new_files[target_rel] = entry
+                    copied_count += 1
+                    print(f"Copied to USB: {target_rel}")
+                except Exception as e:
+                    print(f"Error copying {source_path} to USB: {e}")
+
+            # Delete files that were removed from the library
+            # (FAT32/exFAT is case insensitive: "song.mp3" and "Song.mp3" are the same file)
+            planned = set(target_rel.casefold() for target_rel in plan)
+            deleted_count = 0
+            for target_rel in manifest['files']:
+                if target_rel.casefold() in planned:
+                    continue
+                target_path = os.path.join(target_folder, target_rel)
+                try:
+                    if os.path.exists(target_path):
+                        os.remove(target_path)
+                        deleted_count += 1
+                        print(f"Deleted from USB: {target_rel}")
+                    self.remove_empty_usb_folders(target_folder, os.path.dirname(target_path))
+                except Exception as e:
+                    print(f"Error deleting {target_path}: {e}")
+
+            manifest['source_folder'] = self.selected_folder
+            manifest['timestamp'] = datetime.now().strftime("%Y%m%d_%H%M%S")
+            manifest['files'] = new_files
+            self.save_usb_manifest(target_folder, manifest)
+
+            self.progress.setVisible(False)
+
+            message = (f'{copied_count} files copied, {deleted_count} files deleted, '
+                       f'{len(new_files) - copied_count} files unchanged.')
+            if skipped:
+                message += f'\n\n{len(skipped)} files skipped (head unit limits):\n' + '\n'.join(skipped[:10])
+            QtWidgets.QMessageBox.information(self, 'USB Sync Finished', message)
+
+        except Exception as e:
+            self.progress.setVisible(False)
+            QtWidgets.QMessageBox.critical(self, 'Error', f'Error syncing to USB: {e}')
+
+    def paths_nested(self, path_a, path_b):
+        """Checks if one folder is inside the other (or both are the same)"""
+        root_a = os.path.normcase(os.path.abspath(path_a))
+        root_b = os.path.normcase(os.path.abspath(path_b))
+        # Different drives (e.g. stick E:\ and library C:\Music) can't be nested
+        if os.path.splitdrive(root_a)[0] != os.path.splitdrive(root_b)[0]:
+            return False
+        try:
+            return os.path.commonpath([root_a, root_b]) in (root_a, root_b)
+        except ValueError:
+            return False
+
+    def plan_usb_sync(self, source_folder):
+        """Maps target paths on the stick to source MP3s and enforces head unit limits"""
+        plan = {}
+        planned = set()  # Case-folded target paths (FAT32/exFAT is case insensitive)
+        skipped = []
+
+        for root, dirs, files in os.walk(source_folder):
+            dirs.sort()
+            mp3_names = sorted(f for f in files if f.lower().endswith('.mp3'))
+            if not mp3_names:
+                continue
+
+            rel_folder = os.path.relpath(root, source_folder)
+            folder_parts = [] if rel_folder == '.' else [self.sanitize_usb_name(p) for p in rel_folder.split(os.sep)]
+
+            if len(mp3_names) > USB_MAX_FILES_PER_FOLDER:
+                for name in mp3_names[USB_MAX_FILES_PER_FOLDER:]:
+                    skipped.append(os.path.join(rel_folder, name))
+                mp3_names = mp3_names[:USB_MAX_FILES_PER_FOLDER]
+
+            for name in mp3_names:
+                target_rel = self.build_usb_target_path(folder_parts, name)
+                if not target_rel or target_rel.casefold() in planned:
+                    skipped.append(os.path.join(rel_folder, name))
+                    continue
+                planned.add(target_rel.casefold())
+                plan[target_rel] = os.path.join(root, name)
+
+        return plan, skipped
+
+    def build_usb_target_path(self, folder_parts, filename):
+        """Builds target path, shortening file name to fit the head unit path limit"""
+        stem, ext = os.path.splitext(self.sanitize_usb_name(filename))
+        folder_rel = os.path.join(*folder_parts) if folder_parts else ''
+
+        # Leave room for separator and extension
+        available = USB_MAX_PATH_LENGTH - len(folder_rel) - len(ext) - (1 if folder_rel else 0)
+        if available < 8:
+            return None
+
+        stem = stem[:available].rstrip(' .')
+        return os.path.join(folder_rel, stem + ext) if folder_rel else stem + ext
+
+    def sanitize_usb_name(self, name):
+        """Removes characters and trailing dots/spaces that FAT32/exFAT does not allow"""
+        return self.sanitize_filename(name).rstrip(' .')
+
+    def get_usb_file_entry(self, source_path, old_entry=None):
+        """Creates manifest entry (size, mtime, tag digest) for a source file"""
+        stat = os.stat(source_path)
+        entry = {
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime)
+        }
+        # Reuse known digests if size and mtime did not change (avoids reading the file)
+        if old_entry and old_entry.get('size') == entry['size'] and old_entry.get('mtime') == entry['mtime']:
+            entry['tag_digest'] = old_entry.get('tag_digest')
+            entry['audio_hash'] = old_entry.get('audio_hash')
+        else:
+            entry['tag_digest'] = self.compute_tag_digest(source_path)
+            entry['audio_hash'] = self.hash_index.get_hash(source_path)
+        return entry
+
+    def usb_file_changed(self, entry, old_entry):
+        """Checks if a file must be copied again based on the manifest entry"""
+        if not old_entry:
+            return True
+        if entry['size'] != old_entry.get('size'):
+            return True
+        if entry['mtime'] == old_entry.get('mtime'):
+            return False
+        # Only mtime changed: skip only if tags and audio content are both known to be identical
+        if not entry.get('audio_hash') or not old_entry.get('audio_hash'):
+            return True
+        return (entry['tag_digest'] != old_entry.get('tag_digest')
+                or entry['audio_hash'] != old_entry['audio_hash'])
+
+    def compute_tag_digest(self, mp3_path):
+        """Hashes ID3v2 and ID3v1 tag bytes of an MP3 file"""
+        digest = hashlib.sha1()
+        with open(mp3_path, 'rb') as f:
+            header = f.read(10)
+            if len(header) == 10 and header.startswith(b'ID3'):
+                # Syncsafe tag size (7 bits per byte)
+                size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+                digest.update(header)
+                digest.update(f.read(size))
+
+            f.seek(0, os.SEEK_END)
+            if f.tell() >= 128:
+                f.seek(-128, os.SEEK_END)
+                tail = f.read(128)
+                if tail.startswith(b'TAG'):
+                    digest.update(tail)
+        return digest.hexdigest()
+
+    def copy_file_chunked(self, source_path, target_path):
+        """Copies a file in large sequential chunks (fast on slow USB media)"""
+        os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+        temp_path = target_path + '.part'
+        try:
+            with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(USB_COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(temp_path, target_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def remove_empty_usb_folders(self, target_folder, folder):
+        """Removes empty folders on the stick up to the stick root"""
+        target_root = os.path.abspath(target_folder)
+        folder = os.path.abspath(folder)
+        while folder != target_root and folder.startswith(target_root) and os.path.isdir(folder):
+            if os.listdir(folder):
+                break
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+
+    def load_usb_manifest(self, target_folder):
+        """Loads sync manifest from the stick (empty manifest if none exists)"""
+        manifest_file = os.path.join(target_folder, USB_MANIFEST_NAME)
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if isinstance(manifest.get('files'), dict):
+                    return manifest
+            except Exception as e:
+                print(f"Error reading USB manifest: {e}")
+        return {'version': 1, 'files': {}}
+
+    def save_usb_manifest(self, target_folder, manifest):
+        """Saves sync manifest on the stick"""
+        manifest_file = os.path.join(target_folder, USB_MANIFEST_NAME)
+        temp_file = manifest_file + '.part'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(temp_file, manifest_file)
+
+    def import_catalog(self):
+        """Imports album metadata into the local catalog for offline lookups"""
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, 'Select Catalog File', '',
+            'Catalog files (*.json *.jsonl *.db);;All files (*)'
+        )
+        if not path:
+            return
+
+        try:
+            self.progress.setVisible(True)
+            self.progress.setRange(0, 0)  # Indeterminate progress
+            QtWidgets.QApplication.processEvents()
+
+            count = self.catalog.import_file(path)
+
+            self.progress.setVisible(False)
+            self.progress.setRange(0, 1)
+            QtWidgets.QMessageBox.information(
+                self, 'Catalog Imported',
+                f'{count} albums imported.\n\n'
+                f'The local catalog now contains {self.catalog.count()} albums.'
+            )
+        except Exception as e:
+            self.progress.setVisible(False)
+            self.progress.setRange(0, 1)
+            QtWidgets.QMessageBox.critical(self, 'Error', f'Error importing catalog: {e}')
+
     def process_album_folder(self, folder_path, album_name, artist_name):
         """Processes an album folder automatically"""
         try:
@@ -454,6 +1280,15 @@ class Mp3MetadataApp(QtWidgets.QWidget):
 
     def find_album_id(self, album_name, artist_name):
         """Finds album ID via direct search with artist and album"""
+        # Local catalog first (indexed lookup by normalized album name)
+        album_id = self.match_album_artist(self.catalog.find_albums(album_name), album_name, artist_name)
+        if album_id:
+            return album_id
+        
+        if not self.spotify:
+            print(f"No matching album in catalog for '{artist_name} - {album_name}' (offline)")
+            return None
+        
         search_queries = [
             f'artist:"{artist_name}" album:"{album_name}"',  # Best search with both
             f'"{artist_name}" "{album_name}"',               # Simple combination
@@ -465,30 +1300,9 @@ class Mp3MetadataApp(QtWidgets.QWidget):
             try:
                 print(f"Searching album with query: {query}")
                 results = self.spotify.search(q=query, type='album', limit=10)
-                for album in results['albums']['items']:
-                    # Album name must match
-                    album_match = album['name'].lower() == album_name.lower()
-                    
-                    if album_match:
-                        # Check if album artist is substring of song artist
-                        for album_artist in album['artists']:
-                            album_artist_name = album_artist['name'].lower()
-                            song_artist_name = artist_name.lower()
-                            
-                            # Exact match (best priority)
-                            if album_artist_name == song_artist_name:
-                                print(f"Exact match found: {album_artist['name']} - {album['name']} (ID: {album['id']})")
-                                return album['id']
-                            
-                            # Album artist is substring of song artist (e.g. "Drake" in "Drake feat. Rihanna")
-                            elif album_artist_name in song_artist_name:
-                                print(f"Substring match found: Album artist '{album_artist['name']}' in song artist '{artist_name}' - {album['name']} (ID: {album['id']})")
-                                return album['id']
-                            
-                            # Song artist is substring of album artist (rare case)
-                            elif song_artist_name in album_artist_name:
-                                print(f"Reverse substring match found: Song artist '{artist_name}' in album artist '{album_artist['name']}' - {album['name']} (ID: {album['id']})")
-                                return album['id']
+                album_id = self.match_album_artist(results['albums']['items'], album_name, artist_name)
+                if album_id:
+                    return album_id
                 
             except Exception as e:
                 print(f"Error with query '{query}': {e}")
@@ -497,11 +1311,59 @@ class Mp3MetadataApp(QtWidgets.QWidget):
         print(f"No matching album found for '{artist_name} - {album_name}'")
         return None
 
+    def match_album_artist(self, albums, album_name, artist_name):
+        """Returns ID of the first album whose name and album artist match"""
+        for album in albums:
+            # Album name must match (same normalization as the catalog index)
+            album_match = MetadataCatalog.normalize(album['name']) == MetadataCatalog.normalize(album_name)
+            
+            if album_match:
+                # Check if album artist is substring of song artist
+                for album_artist in album['artists']:
+                    album_artist_name = MetadataCatalog.normalize(album_artist['name'])
+                    song_artist_name = MetadataCatalog.normalize(artist_name)
+                    
+                    # Exact match (best priority)
+                    if album_artist_name == song_artist_name:
+                        print(f"Exact match found: {album_artist['name']} - {album['name']} (ID: {album['id']})")
+                        return album['id']
+                    
+                    # Album artist is substring of song artist (e.g. "Drake" in "Drake feat. Rihanna")
+                    elif album_artist_name in song_artist_name:
+                        print(f"Substring match found: Album artist '{album_artist['name']}' in song artist '{artist_name}' - {album['name']} (ID: {album['id']})")
+                        return album['id']
+                    
+                    # Song artist is substring of album artist (rare case)
+                    elif song_artist_name in album_artist_name:
+                        print(f"Reverse substring match found: Song artist '{artist_name}' in album artist '{album_artist['name']}' - {album['name']} (ID: {album['id']})")
+                        return album['id']
+        
+        return None
+
+    def search_track(self, query, title, artist=None, limit=5):
+        """Finds a track in the local catalog, falls back to Spotify search"""
+        track = self.catalog.find_track(title, artist)
+        if track:
+            return track
+        
+        if not self.spotify:
+            return None
+        
+        results = self.spotify.search(q=query, type='track', limit=limit)
+        if results['tracks']['items']:
+            return results['tracks']['items'][0]
+        return None
+
     def load_album_data(self, album_id):
         """Loads album tracks and cover URL with only one API call"""
         try:
-            # Only ONE album call for all data (incl. tracks and cover)
-            album_info = self.spotify.album(album_id, market='DE')
+            # Local catalog first, otherwise only ONE album call for all data (incl. tracks and cover)
+            album_info = self.catalog.get_album(album_id)
+            if not self.catalog.has_tracks(album_info) and self.spotify:
+                album_info = self.spotify.album(album_id, market='DE')
+                if album_info:
+                    # Keep for later runs and offline use
+                    self.catalog.add_album(album_info)
             album_tracks = {}
             album_cover_url = None
             
@@ -573,7 +1435,8 @@ class Mp3MetadataApp(QtWidgets.QWidget):
             audio.save()
             
             # Add cover (only once)
-            if album_cover_url:
+            # Offline mode: no network, keep existing covers
+            if album_cover_url and self.spotify:
                 try:
                     self.add_album_cover(mp3_path, album_cover_url)
                     print(f"Cover added: {filename}")
@@ -608,11 +1471,13 @@ class Mp3MetadataApp(QtWidgets.QWidget):
                 title = parts[1].strip()
                 query = f"artist:{artist} track:{title}"
             else:
+                artist = None
+                title = clean_name
                 query = clean_name
             
-            results = self.spotify.search(q=query, type='track', limit=5)
-            if results['tracks']['items']:
-                return results['tracks']['items'][0]['name']
+            track = self.search_track(query, title, artist, limit=5)
+            if track:
+                return track['name']
             else:
                 return clean_name.split(' - ', 1)[1].strip() if ' - ' in clean_name else clean_name
                 
@@ -677,10 +1542,23 @@ class Mp3MetadataApp(QtWidgets.QWidget):
     def add_album_cover(self, mp3_path, cover_url):
         """Downloads album cover from URL and adds it to MP3"""
         try:
-            # Download image from URL
-            response = requests.get(cover_url, timeout=10)
-            response.raise_for_status()
-            image_data = response.content
+            # Download image from URL (once per album, same URL for all tracks)
+            if not hasattr(self, '_cover_cache'):
+                self._cover_cache = {}
+            if cover_url in self._cover_cache:
+                image_data = self._cover_cache[cover_url]
+                if image_data is None:
+                    # Download already failed for this album, don't wait through retries again
+                    raise RuntimeError(f"Cover download failed before: {cover_url}")
+            else:
+                try:
+                    response = self.http.get(cover_url, timeout=HTTP_TIMEOUT)
+                    response.raise_for_status()
+                    image_data = response.content
+                except Exception:
+                    self._cover_cache = {cover_url: None}
+                    raise
+                self._cover_cache = {cover_url: image_data}  # Keep only the current album cover
             
             # Determine MIME type based on first bytes
             if image_data.startswith(b'\xff\xd8\xff'):